@@ -0,0 +1,133 @@
+# Copyright (C) 2021  The AURA developers
+# See the AUTHORS file at the top-level directory of this distribution
+# SPDX-License-Identifier: GPL-3.0
+
+"""Compare aura_ecg_detector.detect_ecg run on pyedflib.EdfReader and on
+the memory-mapped EdfMemmapReader.
+
+Each reader runs in its own process so that peak RSS is measured
+independently. With pyedflib, the ECG channel is decoded at once by
+readSignal, as the detector formerly did. With EdfMemmapReader, only the
+signal quality pass reads the whole channel, block by block, and each
+usable segment is then decoded once for all detectors.
+
+    python bench_edf_reader.py -i file.edf
+    python bench_edf_reader.py -i big.edf --generate 4
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "..", "scripts"))
+
+
+def generate_edf(filename, hours, fs=256, n_eeg=30):
+    """Write a synthetic EDF of the given duration, one minute at a time.
+    """
+    import pyedflib
+
+    labels = ["EEG CH" + str(k) + "-REF" for k in range(n_eeg)] + \
+        ["EEG EKG1-REF"]
+    writer = pyedflib.EdfWriter(filename, len(labels),
+                                file_type=pyedflib.FILETYPE_EDF)
+    writer.setSignalHeaders([{"label": label,
+                              "dimension": "uV",
+                              "sample_frequency": fs,
+                              "physical_max": 3000,
+                              "physical_min": -3000,
+                              "digital_max": 32767,
+                              "digital_min": -32768,
+                              "transducer": "",
+                              "prefilter": ""} for label in labels])
+
+    rng = np.random.default_rng(0)
+    t = np.arange(60 * fs) / fs
+    ecg = 800 * np.exp(-((t % 0.8) - 0.4) ** 2 / (2 * 0.012 ** 2))
+    for _ in range(int(hours * 60)):
+        writer.writeSamples(
+            [50 * rng.standard_normal(len(t)) for _ in range(n_eeg)] +
+            [ecg + 20 * rng.standard_normal(len(t))])
+    writer.close()
+
+
+def run_single(reader_name, filename):
+    import aura_ecg_detector
+    # Detector backends are imported before measuring
+    import biosppy.signals.ecg  # noqa: F401
+    import ecgdetectors  # noqa: F401
+    from wfdb import processing  # noqa: F401
+
+    if reader_name == "pyedflib":
+        import pyedflib
+
+        class PyedflibReader(pyedflib.EdfReader):
+            # Former detector behaviour, the whole channel decoded at once
+            def getSignalView(self, chn):
+                return self.readSignal(chn)
+
+        aura_ecg_detector.EdfMemmapReader = PyedflibReader
+
+    import_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+
+    with tempfile.TemporaryDirectory() as output_dir:
+        output_filename = os.path.join(output_dir, "res.json")
+        start_time = time.perf_counter()
+        # Detectors report their failures on stdout
+        with contextlib.redirect_stdout(sys.stderr):
+            aura_ecg_detector.detect_ecg(filename, output_filename)
+        total_time = time.perf_counter() - start_time
+        n_beats = len(json.load(open(output_filename))["consensus"]["qrs"])
+
+    # ru_maxrss is expressed in kilobytes on Linux
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+    print(reader_name, total_time, import_rss, peak_rss, n_beats)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='input parameters')
+    parser.add_argument('-i',
+                        '--input_file',
+                        dest='input_filename',
+                        help='EDF file path')
+    parser.add_argument('--generate',
+                        dest='generate_hours',
+                        type=float,
+                        help='first write a synthetic EDF of that many hours')
+    parser.add_argument('--reader',
+                        dest='reader_name',
+                        help='run a single reader - pyedflib or memmap')
+    args = parser.parse_args()
+
+    if args.reader_name is not None:
+        run_single(args.reader_name, args.input_filename)
+        sys.exit()
+
+    if args.generate_hours is not None:
+        generate_edf(args.input_filename, args.generate_hours)
+
+    print("File: " + args.input_filename + " - " + str(
+        round(os.path.getsize(args.input_filename) / 2 ** 30, 2)) + " GB")
+    print("{:<10}{:>12}{:>18}{:>16}{:>10}".format(
+        "reader", "detect (s)", "imports RSS (MB)", "peak RSS (MB)",
+        "beats"))
+    for reader_name in ["pyedflib", "memmap"]:
+        output = subprocess.run([sys.executable,
+                                 os.path.abspath(__file__),
+                                 "-i", args.input_filename,
+                                 "--reader", reader_name],
+                                capture_output=True,
+                                text=True,
+                                check=True).stdout.split()
+        print("{:<10}{:>12.2f}{:>18.1f}{:>16.1f}{:>10}".format(
+            output[0], float(output[1]), float(output[2]),
+            float(output[3]), output[4]))
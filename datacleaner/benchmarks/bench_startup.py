@@ -0,0 +1,89 @@
+# Copyright (C) 2021  The AURA developers
+# See the AUTHORS file at the top-level directory of this distribution
+# SPDX-License-Identifier: GPL-3.0
+
+"""Measure the startup cost of the data cleaner scripts.
+
+Reports the wall time of "--help" for each script, then compares running
+the ECG detector on the same EDF file N times, either as N processes or as
+N jobs sent to a single "--serve" worker.
+
+    python bench_startup.py -i file.edf -n 10
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+SCRIPTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           "..", "scripts")
+DETECTOR_SCRIPT = os.path.join(SCRIPTS_DIR, "aura_ecg_detector.py")
+FEATURES_SCRIPT = os.path.join(SCRIPTS_DIR, "aura_features_computation.py")
+
+
+def time_command(command, stdin_data=None):
+    start_time = time.perf_counter()
+    subprocess.run(command,
+                   input=stdin_data,
+                   stdout=subprocess.DEVNULL,
+                   stderr=subprocess.DEVNULL,
+                   text=True,
+                   check=True)
+    return time.perf_counter() - start_time
+
+
+def bench_help(n_runs):
+    for script in [DETECTOR_SCRIPT, FEATURES_SCRIPT]:
+        durations = [time_command([sys.executable, script, "--help"])
+                     for _ in range(n_runs)]
+        print("{:<40}{:>10.3f} s".format(
+            os.path.basename(script) + " --help",
+            statistics.median(durations)))
+
+
+def bench_jobs(input_filename, n_jobs):
+    with tempfile.TemporaryDirectory() as output_dir:
+        output_filenames = [os.path.join(output_dir, str(k) + ".json")
+                            for k in range(n_jobs)]
+
+        processes_duration = 0
+        for output_filename in output_filenames:
+            processes_duration += time_command([sys.executable,
+                                                DETECTOR_SCRIPT,
+                                                "-i", input_filename,
+                                                "-o", output_filename])
+
+        jobs = "".join([json.dumps({"input_filename": input_filename,
+                                    "output_filename": output_filename}) +
+                        "\n" for output_filename in output_filenames])
+        serve_duration = time_command(
+            [sys.executable, DETECTOR_SCRIPT, "--serve"], jobs)
+
+    print("{:<40}{:>10.3f} s".format(str(n_jobs) + " detector processes",
+                                     processes_duration))
+    print("{:<40}{:>10.3f} s".format("1 worker, " + str(n_jobs) + " jobs",
+                                     serve_duration))
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='input parameters')
+    parser.add_argument('-i',
+                        '--input_file',
+                        dest='input_filename',
+                        help='EDF file path')
+    parser.add_argument('-n',
+                        dest='n_runs',
+                        type=int,
+                        default=10,
+                        help='number of runs')
+    args = parser.parse_args()
+
+    bench_help(args.n_runs)
+    if args.input_filename is not None:
+        bench_jobs(os.path.abspath(args.input_filename), args.n_runs)
@@ -3,8 +3,9 @@
 # See the AUTHORS file at the top-level directory of this distribution
 # SPDX-License-Identifier: GPL-3.0
 
-# QRS_DETECTORS=("gqrs" "xqrs" "hamilton" "engelsee" "swt")
-QRS_DETECTORS=("hamilton")
+# QRS_DETECTORS=("gqrs" "xqrs" "hamilton" "engelsee" "swt" "consensus")
+# Features are computed once on the fused series of all detectors
+QRS_DETECTORS=("consensus")
 
 ## Option - select input directory to be copied from and output directory to copy into
 while getopts ":i:o:" option; do
@@ -29,6 +30,13 @@ fi
 # Create dir_out if needed
 mkdir -p $dir_out
 
+# ECG detection and features computation run in warm workers (--serve),
+# fed with one JSON job per line, to pay python imports only once
+jobs_ecg=$(mktemp)
+jobs_feats=$(mktemp)
+# Job lines are built from key value arguments, escaped by json.dumps
+json_job='import json, sys; print(json.dumps(dict(zip(sys.argv[1::2], sys.argv[2::2]))))'
+
 ## List all EDF files in dir_edf ##
 for edf_file in $(find $dir_edf/ -type f -name "*.edf" ); do
 
@@ -48,14 +56,9 @@ for edf_file in $(find $dir_edf/ -type f -name "*.edf" ); do
     # Extract rr-intervals.
     file_out_ecg="${dir_out_full}/res_${base_name}.json"
     echo "    EDF file [$edf_file]" | tee -a $LOG
-    python3 ${dir_script}/aura_ecg_detector.py \
-	    -i $edf_file \
-	    -o $file_out_ecg >> $LOG 2>&1
-    if [ $? -eq 0 ]; then
-      echo "    ECG $file_out_ecg - OK" | tee -a $LOG
-    else
-      echo "    ECG $file_out_ecg - Fail" | tee -a $LOG
-    fi
+    python3 -c "$json_job" \
+      input_filename "$edf_file" \
+      output_filename "$file_out_ecg" >> $jobs_ecg
 
     # Extract annotations.
     tse_file="$dir_out_full/${base_name}.tse_bi"
@@ -73,17 +76,56 @@ for edf_file in $(find $dir_edf/ -type f -name "*.edf" ); do
     # Extract features.
     for qrs_detector in ${QRS_DETECTORS[@]}; do
 	file_out_feats="${dir_out_full}/feats_${qrs_detector}_${base_name}.json"
-	python3 ${dir_script}/aura_features_computation.py \
-		-i $file_out_ecg \
-		-a $file_out_annot \
-		-o $file_out_feats \
-		-q $qrs_detector >> $LOG 2>&1
-	if [ $? -eq 0 ]; then
-	    echo "    FEATS $file_out_feats - OK" | tee -a $LOG
-	else
-	    echo "    FEATS $file_out_feats - Fail" | tee -a $LOG
-	fi
+	python3 -c "$json_job" \
+	    input_filename "$file_out_ecg" \
+	    output_filename "$file_out_feats" \
+	    annotations_filename "$file_out_annot" \
+	    qrs_detector "$qrs_detector" >> $jobs_feats
     done
 done
 
+# Run a jobs file in warm workers, logging one status line per job. When a
+# worker dies (out of memory, crash in a detector native code), the job it
+# was running is reported as Fail and a new worker takes the remaining jobs.
+worker_died=0
+run_worker() {
+    script=$1
+    jobs=$2
+    step=$3
+    statuses=$(mktemp)
+    n_jobs=$(wc -l < $jobs)
+    n_done=0
+    while [ $n_done -lt $n_jobs ]; do
+	tail -n +$((n_done + 1)) $jobs | \
+	    python3 $script --serve 2>> $LOG | tee -a $statuses | \
+	    while IFS=$'\t' read -r status output_filename; do
+		echo "    $step $output_filename - $status" | tee -a $LOG
+	    done
+	worker_status=${PIPESTATUS[1]}
+	n_done=$(wc -l < $statuses)
+	if [ $worker_status -ne 0 ]; then
+	    echo "    Worker $script exited with status $worker_status" >> $LOG
+	    worker_died=1
+	fi
+	if [ $n_done -lt $n_jobs ]; then
+	    output_filename=$(sed -n "$((n_done + 1))p" $jobs | python3 -c \
+		'import json, sys; print(json.load(sys.stdin)["output_filename"])')
+	    echo "    $step $output_filename - Fail" | tee -a $LOG
+	    printf 'Fail\t%s\n' "$output_filename" >> $statuses
+	    n_done=$((n_done + 1))
+	fi
+    done
+    rm -f $statuses
+}
+
+echo "* Extracting rr-intervals" | tee -a $LOG
+run_worker ${dir_script}/aura_ecg_detector.py $jobs_ecg ECG
+
+echo "* Extracting features" | tee -a $LOG
+run_worker ${dir_script}/aura_features_computation.py $jobs_feats FEATS
+
+rm -f $jobs_ecg $jobs_feats
+
+exit $worker_died
+
 exit 0
@@ -1,24 +1,58 @@
 import numpy as np
-# install from https://pypi.org/project/py-ecg-detectors/
-from ecgdetectors import Detectors
-from wfdb import processing
-import biosppy.signals.ecg as bsp_ecg
 import argparse
+import gc
 import json
-import pyedflib
 import os
+from aura_edf_reader import EdfMemmapReader
+from aura_worker import serve
 
 
 # We consider two matching QRS as QRS frames within a 50 milliseconds window
 MATCHING_QRS_FRAMES_TOLERANCE = 50
 # We consider the laximum duration of a beat in milliseconds - 33bpm
 MAX_SINGLE_BEAT_DURATION = 1800
+# We consider the minimum duration of a beat in milliseconds - 200bpm
+MIN_SINGLE_BEAT_DURATION = 300
+# Detectors do not mark the same point of the QRS complex (onset, R peak),
+# their lag is estimated on QRS within 150 milliseconds of the reference ones
+MAX_DETECTOR_LAG = 150
+# Reference detectors for lags and fused beats timestamps, by preference
+REFERENCE_DETECTORS = ["hamilton", "xqrs", "gqrs", "swt"]
+# Lag corrected QRS still jitter (swt), so fused beats are grouped within a
+# wider 100 milliseconds window
+CONSENSUS_QRS_FRAMES_TOLERANCE = 100
+# A fused beat must be seen by at least two detectors
+CONSENSUS_MIN_AGREEMENT = 2
+# Detectors poorly correlated with all others are left out of the fusion
+CONSENSUS_MIN_CORRCOEF = 0.5
+# Two fused beats cannot be closer than the QRS refractory period
+CONSENSUS_REFRACTORY_PERIOD = 200
+# Signal quality is assessed on 2 seconds windows
+SIGNAL_QUALITY_WINDOW = 2000
+# ECG signal is decoded by blocks of 150 quality windows - 5 minutes
+SIGNAL_QUALITY_BLOCK_WINDOWS = 150
+# A window with a standard deviation ten times below the median one is flat
+MIN_RELATIVE_VARIANCE = 0.01
+# Maximum ratio of repeated samples in a window - disconnected lead
+MAX_FLATLINE_RATIO = 0.5
+# Maximum ratio of samples at the signal extrema in a window - saturation
+MAX_CLIPPING_RATIO = 0.05
+# Signal quality is not assessed on shorter recordings, detected as a whole
+MIN_USABLE_SEGMENT_DURATION = 10000
+# Detectors memory grows with their input, they run on 30 minutes blocks
+DETECTION_BLOCK_DURATION = 1800000
+# Blocks are extended by 10 seconds on each side for detectors to settle
+DETECTION_BLOCK_OVERLAP = 10000
 
 
 # List of RR detection algorithms
+# Detector backends are heavy to import, they are only loaded when used
 
 
 def detect_qrs_swt(ecg_data, fs):
+    # install from https://pypi.org/project/py-ecg-detectors/
+    from ecgdetectors import Detectors
+
     qrs_frames = []
     try:
         detectors = Detectors(fs)  # Explain why
@@ -30,6 +64,8 @@ def detect_qrs_swt(ecg_data, fs):
 
 
 def detect_qrs_xqrs(ecg_data, fs):
+    from wfdb import processing
+
     qrs_frames = []
     try:
         qrs_frames = processing.xqrs_detect(sig=ecg_data, fs=fs, verbose=False)
@@ -40,19 +76,24 @@ def detect_qrs_xqrs(ecg_data, fs):
 
 
 def detect_qrs_gqrs(ecg_data, fs):
+    from wfdb import processing
+
     qrs_frames = []
     try:
-        qrs_frames = processing.qrs.gqrs_detect(sig=ecg_data, fs=fs)
+        qrs_frames = processing.qrs.gqrs_detect(sig=ecg_data,
+                                                fs=fs).tolist()
     except:
         print("Exception in detect_qrs_gqrs")
-    return qrs_frames.tolist()
+    return qrs_frames
 
 
 def detect_qrs_hamilton(ecg_data, fs):
+    import biosppy.signals.ecg as bsp_ecg
+
     qrs_frames = []
     try:
         qrs_frames = bsp_ecg.hamilton_segmenter(
-            signal=np.array(ecg_data),
+            signal=np.asarray(ecg_data),
             sampling_rate=fs)[0]
 
     except:
@@ -63,22 +104,84 @@ def detect_qrs_hamilton(ecg_data, fs):
 # Centralising function
 
 
-def get_cardiac_infos(ecg_data, fs, method):
+def detect_qrs(ecg_data, fs, method):
     if method == "xqrs":
         qrs_frames = detect_qrs_xqrs(ecg_data, fs)
     elif method == "gqrs":
         qrs_frames = detect_qrs_gqrs(ecg_data, fs)
     elif method == "swt":
-        qrs_frames = detect_qrs_gqrs(ecg_data, fs)
+        qrs_frames = detect_qrs_swt(ecg_data, fs)
     elif method == "hamilton":
         qrs_frames = detect_qrs_hamilton(ecg_data, fs)
+    return qrs_frames
+
 
-    rr_intervals = np.zeros(0)
-    hr = np.zeros(0)
-    if len(qrs_frames):
-        rr_intervals = to_rr_intervals(qrs_frames, fs)
-        hr = to_hr(rr_intervals)
-    return qrs_frames, rr_intervals, hr
+def get_detection_blocks(usable_segments, fs):
+    """Split [start, end] frame segments into DETECTION_BLOCK_DURATION
+    blocks, as [start, end, keep_start, keep_end] frames: detection runs on
+    [start, end], extended by DETECTION_BLOCK_OVERLAP within the segment,
+    and only QRS within [keep_start, keep_end] are kept.
+    """
+    block_frames = int(DETECTION_BLOCK_DURATION * 0.001 * fs)
+    overlap_frames = int(DETECTION_BLOCK_OVERLAP * 0.001 * fs)
+
+    detection_blocks = []
+    for segment_start, segment_end in usable_segments:
+        for keep_start in range(segment_start, segment_end, block_frames):
+            keep_end = min(keep_start + block_frames, segment_end)
+            detection_blocks.append(
+                [max(keep_start - overlap_frames, segment_start),
+                 min(keep_end + overlap_frames, segment_end),
+                 keep_start,
+                 keep_end])
+    return detection_blocks
+
+
+def get_cardiac_infos(ecg_data, fs, fs_by_method, usable_segments=None):
+    """Detect QRS frames, RR intervals and heart rate with each method of
+    fs_by_method, run at its own sampling frequency, fs being the ecg_data
+    one.
+
+    When usable_segments (list of [start, end] frames) is given, detection
+    only runs on those segments and frames are shifted back to the whole
+    signal time base. Segments are detected by blocks, each decoded once
+    from ecg_data, which may be a lazily decoded signal, and handed to all
+    methods.
+    """
+    if usable_segments is None:
+        usable_segments = [[0, len(ecg_data)]]
+    tolerance_frames = MATCHING_QRS_FRAMES_TOLERANCE * 0.001 * fs
+
+    qrs_frames = {method: [] for method in fs_by_method.keys()}
+    for start, end, keep_start, keep_end in get_detection_blocks(
+            usable_segments, fs):
+        block_data = np.asarray(ecg_data[start:end])
+        for method, method_fs in fs_by_method.items():
+            block_qrs_frames = start + np.asarray(
+                detect_qrs(block_data, method_fs, method), dtype=int)
+            block_qrs_frames = block_qrs_frames[
+                (block_qrs_frames >= keep_start) &
+                (block_qrs_frames < keep_end)]
+
+            # A QRS on a block boundary may be detected in both blocks
+            if len(qrs_frames[method]) and len(block_qrs_frames) and (
+                    block_qrs_frames[0] - qrs_frames[method][-1] <
+                    tolerance_frames):
+                block_qrs_frames = block_qrs_frames[1:]
+            qrs_frames[method].extend(block_qrs_frames.tolist())
+        del block_data
+        # wfdb gqrs leaves reference cycles holding its buffers behind
+        gc.collect()
+
+    cardiac_infos = {}
+    for method, method_fs in fs_by_method.items():
+        rr_intervals = np.zeros(0)
+        hr = np.zeros(0)
+        if len(qrs_frames[method]):
+            rr_intervals = to_rr_intervals(qrs_frames[method], method_fs)
+            hr = to_hr(rr_intervals)
+        cardiac_infos[method] = (qrs_frames[method], rr_intervals, hr)
+    return cardiac_infos
 
 
 # UTILITIES
@@ -99,10 +202,11 @@ def to_hr(rr_intervals):
     return hr
 
 
-def compute_qrs_frames_correlation(fs, qrs_frames_1, qrs_frames_2):
+def compute_qrs_frames_correlation(fs, qrs_frames_1, qrs_frames_2,
+                                   tolerance=MATCHING_QRS_FRAMES_TOLERANCE):
     single_frame_duration = 1./fs
 
-    frame_tolerance = MATCHING_QRS_FRAMES_TOLERANCE * (
+    frame_tolerance = tolerance * (
         0.001 / single_frame_duration)
     max_single_beat_frame_duration = MAX_SINGLE_BEAT_DURATION * (
         0.001 / single_frame_duration)
@@ -148,6 +252,266 @@ def compute_qrs_frames_correlation(fs, qrs_frames_1, qrs_frames_2):
     return correlation_coefs, matching_frames, missing_beats_duration
 
 
+def get_signal_quality_mask(ecg_data, fs):
+    """Flag the SIGNAL_QUALITY_WINDOW windows of ecg_data usable for QRS
+    detection.
+
+    A window is discarded when its variance collapses compared to the
+    median window (flat or disconnected lead), when most of its samples
+    repeat the previous one (flatline) or when too many samples sit at the
+    signal extrema (saturation).
+
+    ecg_data is sliced by blocks of SIGNAL_QUALITY_BLOCK_WINDOWS windows,
+    in a single pass.
+    """
+    window_frames = int(SIGNAL_QUALITY_WINDOW * 0.001 * fs)
+    n_windows = len(ecg_data) // window_frames
+    if n_windows == 0:
+        return np.zeros(0, dtype=bool)
+
+    variances = np.zeros(n_windows)
+    flatline_ratio = np.zeros(n_windows)
+    windows_max = np.zeros(n_windows)
+    windows_min = np.zeros(n_windows)
+    windows_max_count = np.zeros(n_windows)
+    windows_min_count = np.zeros(n_windows)
+
+    for first in range(0, n_windows, SIGNAL_QUALITY_BLOCK_WINDOWS):
+        last = min(first + SIGNAL_QUALITY_BLOCK_WINDOWS, n_windows)
+        windows = np.reshape(
+            ecg_data[first * window_frames:last * window_frames],
+            (last - first, window_frames))
+
+        variances[first:last] = np.var(windows, axis=1)
+        flatline_ratio[first:last] = np.mean(
+            np.diff(windows, axis=1) == 0, axis=1)
+        windows_max[first:last] = np.max(windows, axis=1)
+        windows_min[first:last] = np.min(windows, axis=1)
+        windows_max_count[first:last] = np.sum(
+            windows == windows_max[first:last, np.newaxis], axis=1)
+        windows_min_count[first:last] = np.sum(
+            windows == windows_min[first:last, np.newaxis], axis=1)
+
+    median_variance = np.median(variances)
+    low_variance = variances <= MIN_RELATIVE_VARIANCE * median_variance
+
+    flatline = flatline_ratio > MAX_FLATLINE_RATIO
+
+    # Only windows reaching the signal extrema may be saturated
+    clipping_count = np.where(windows_max >= np.max(windows_max),
+                              windows_max_count, 0) + \
+        np.where(windows_min <= np.min(windows_min), windows_min_count, 0)
+    clipping = (clipping_count / window_frames) > MAX_CLIPPING_RATIO
+
+    return np.logical_not(low_variance | flatline | clipping)
+
+
+def get_usable_segments(usable_mask, fs, n_frames):
+    """Merge consecutive usable windows into [start, end] frame segments.
+
+    Only windows flagged by the signal quality mask are dropped: the
+    trailing frames not covering a full window follow the last one, and
+    recordings shorter than MIN_USABLE_SEGMENT_DURATION are kept whole.
+    """
+    window_frames = int(SIGNAL_QUALITY_WINDOW * 0.001 * fs)
+    min_segment_frames = MIN_USABLE_SEGMENT_DURATION * 0.001 * fs
+
+    if n_frames < min_segment_frames:
+        return [[0, int(n_frames)]]
+
+    edges = np.diff(np.concatenate(([0], usable_mask.astype(int), [0])))
+    starts = np.flatnonzero(edges == 1) * window_frames
+    ends = np.flatnonzero(edges == -1) * window_frames
+    ends[ends == len(usable_mask) * window_frames] = n_frames
+
+    usable_segments = [[int(start), int(end)]
+                       for start, end in zip(starts, ends)]
+    return usable_segments
+
+
+def get_same_segment_mask(qrs_frames, usable_segments):
+    """Flag the RR intervals whose two QRS lie in the same usable segment,
+    RR intervals spanning a dropped part of the signal being unreliable.
+    """
+    if len(qrs_frames) == 0 or len(usable_segments) == 0:
+        return np.zeros(max(len(qrs_frames) - 1, 0), dtype=bool)
+
+    segment_starts = [start for start, _ in usable_segments]
+    qrs_segments = np.searchsorted(segment_starts, qrs_frames,
+                                   side="right")
+    return qrs_segments[:-1] == qrs_segments[1:]
+
+
+def get_reference_detector(qrs_frames_by_detector):
+    """First detector of REFERENCE_DETECTORS with detected QRS, None if
+    there is none.
+    """
+    for detector in REFERENCE_DETECTORS:
+        if len(qrs_frames_by_detector.get(detector, [])):
+            return detector
+    return None
+
+
+def get_qrs_frames_lag(reference_qrs_frames, qrs_frames):
+    """Median lag (in seconds) of QRS timestamps behind their nearest
+    reference QRS, QRS further than MAX_DETECTOR_LAG being ignored.
+    """
+    reference_qrs_frames = np.asarray(reference_qrs_frames, dtype=float)
+    qrs_frames = np.asarray(qrs_frames, dtype=float)
+    if len(reference_qrs_frames) == 0 or len(qrs_frames) == 0:
+        return 0.
+
+    # Lags to the reference QRS just before and just after each QRS
+    k = np.searchsorted(reference_qrs_frames, qrs_frames)
+    last = len(reference_qrs_frames) - 1
+    previous_lags = qrs_frames - reference_qrs_frames[np.clip(k - 1, 0, last)]
+    next_lags = qrs_frames - reference_qrs_frames[np.clip(k, 0, last)]
+    lags = np.where(np.abs(previous_lags) < np.abs(next_lags),
+                    previous_lags, next_lags)
+    lags = lags[np.abs(lags) <= MAX_DETECTOR_LAG * 0.001]
+    if len(lags) == 0:
+        return 0.
+    return float(np.median(lags))
+
+
+def get_qrs_frames_lags(qrs_frames_by_detector):
+    """Lag (in seconds) of each detector behind the reference detector.
+    """
+    reference = get_reference_detector(qrs_frames_by_detector)
+    if reference is None:
+        return {detector: 0. for detector in qrs_frames_by_detector.keys()}
+
+    return {detector: get_qrs_frames_lag(
+        qrs_frames_by_detector[reference], qrs_frames)
+        for detector, qrs_frames in qrs_frames_by_detector.items()}
+
+
+def get_consensus_detectors(corrcoefs):
+    """Detectors correlated with at least another one, corrcoefs being the
+    score matrix of detect_ecg, one row per detector.
+    """
+    consensus_detectors = []
+    for k, detector in enumerate(corrcoefs.keys()):
+        others_corrcoefs = [corrcoef for j, corrcoef in
+                            enumerate(corrcoefs[detector]) if j != k]
+        if len(others_corrcoefs) and max(
+                others_corrcoefs) >= CONSENSUS_MIN_CORRCOEF:
+            consensus_detectors.append(detector)
+
+    return consensus_detectors
+
+
+def get_nearest_qrs_frame_index(qrs_frames, first, qrs_frame, tolerance):
+    """Index of the QRS of qrs_frames[first:] nearest to qrs_frame, None if
+    further than tolerance.
+    """
+    k = max(np.searchsorted(qrs_frames, qrs_frame), first)
+    candidates = [index for index in [k - 1, k]
+                  if first <= index < len(qrs_frames)]
+    if len(candidates) == 0:
+        return None
+
+    nearest = min(candidates,
+                  key=lambda index: abs(qrs_frames[index] - qrs_frame))
+    if abs(qrs_frames[nearest] - qrs_frame) > tolerance:
+        return None
+    return nearest
+
+
+def compute_consensus_qrs_frames(qrs_frames_by_detector, corrcoefs):
+    """Fuse the lag corrected QRS timestamps (in seconds) of several
+    detectors.
+
+    Detectors not correlated with any other one in corrcoefs are left out.
+    The earliest QRS not yet fused anchors a group: each detector proposes
+    its nearest QRS within CONSENSUS_QRS_FRAMES_TOLERANCE, the anchor moves
+    to their median, and each detector then contributes its QRS nearest to
+    that anchor. Skipped QRS are spurious detections. A fused beat takes
+    the reference detector timestamp, or the median of its group when the
+    reference detector missed it, so that it does not move with the
+    detectors in the group. It is kept when at least
+    CONSENSUS_MIN_AGREEMENT detectors agree on it, and no closer than
+    CONSENSUS_REFRACTORY_PERIOD to the previous one, the most agreed beat
+    winning.
+
+    Returns the fused QRS timestamps, the per-beat agreement count and a
+    per-RR-interval quality mask, set when both bounding beats are agreed
+    on by a majority of the selected detectors and the RR interval is
+    physiological.
+    """
+    detectors = get_consensus_detectors(corrcoefs)
+    reference = get_reference_detector(
+        {detector: qrs_frames_by_detector[detector]
+         for detector in detectors})
+
+    qrs_frames = np.zeros(0)
+    agreement = np.zeros(0, dtype=int)
+    quality = np.zeros(0, dtype=bool)
+    if len(detectors) < CONSENSUS_MIN_AGREEMENT:
+        return qrs_frames, agreement, quality
+
+    detectors_frames = [np.sort(np.asarray(qrs_frames_by_detector[detector],
+                                           dtype=float))
+                        for detector in detectors]
+    # Index of the first QRS not fused yet, for each detector
+    firsts = [0 for _ in detectors]
+
+    tolerance = CONSENSUS_QRS_FRAMES_TOLERANCE * 0.001
+    refractory_period = CONSENSUS_REFRACTORY_PERIOD * 0.001
+    fused_frames = []
+    fused_agreement = []
+
+    while any([first < len(frames)
+               for first, frames in zip(firsts, detectors_frames)]):
+        anchor = min([frames[first]
+                      for first, frames in zip(firsts, detectors_frames)
+                      if first < len(frames)])
+
+        proposals = [frames[first]
+                     for first, frames in zip(firsts, detectors_frames)
+                     if first < len(frames) and (
+                         frames[first] - anchor) <= tolerance]
+        anchor = np.median(proposals)
+
+        group_frames = []
+        fused_frame = None
+        for k, frames in enumerate(detectors_frames):
+            nearest = get_nearest_qrs_frame_index(frames, firsts[k],
+                                                  anchor, tolerance)
+            if nearest is not None:
+                group_frames.append(frames[nearest])
+                firsts[k] = nearest + 1
+                if detectors[k] == reference:
+                    fused_frame = frames[nearest]
+
+        if len(group_frames) < CONSENSUS_MIN_AGREEMENT:
+            continue
+
+        if fused_frame is None:
+            fused_frame = np.median(group_frames)
+        if len(fused_frames) and (
+                fused_frame - fused_frames[-1]) < refractory_period:
+            if len(group_frames) > fused_agreement[-1]:
+                fused_frames[-1] = fused_frame
+                fused_agreement[-1] = len(group_frames)
+            continue
+
+        fused_frames.append(fused_frame)
+        fused_agreement.append(len(group_frames))
+
+    qrs_frames = np.asarray(fused_frames)
+    agreement = np.asarray(fused_agreement, dtype=int)
+
+    majority = len(detectors) // 2 + 1
+    agreed_beats = agreement >= majority
+    rr_intervals = np.diff(qrs_frames) * 1000
+    quality = agreed_beats[:-1] & agreed_beats[1:] & (
+        rr_intervals >= MIN_SINGLE_BEAT_DURATION) & (
+        rr_intervals <= MAX_SINGLE_BEAT_DURATION)
+
+    return qrs_frames, agreement, quality
+
+
 def get_ecg_labels(signal_labels):
     ecg_labels = [l for l in signal_labels if (
         "EKG" in l.upper() or "ECG" in l.upper())]
@@ -164,20 +528,35 @@ def detect_ecg(input_filename: str,
                       },
             "gqrs": {"qrs": None,
                      "rr_intervals": None,
-                     "hr": None
+                     "hr": None,
+                     "quality": None
                      },
             "xqrs": {"qrs": None,
                      "rr_intervals": None,
-                     "hr": None
+                     "hr": None,
+                     "quality": None
                      },
             "swt": {"qrs": None,
                     "rr_intervals": None,
-                    "hr": None
+                    "hr": None,
+                    "quality": None
                     },
             "hamilton": {"qrs": None,
                          "rr_intervals": None,
-                         "hr": None
+                         "hr": None,
+                         "quality": None
                          },
+            "consensus": {"qrs": None,
+                          "rr_intervals": None,
+                          "hr": None,
+                          "agreement": None,
+                          "quality": None,
+                          "lags": None
+                          },
+            "signal_quality": {"window": None,
+                               "usable": None,
+                               "usable_segments": None
+                               },
             "score": {"corrcoefs":
                       {"gqrs": None,
                        "xqrs": None,
@@ -196,37 +575,49 @@ def detect_ecg(input_filename: str,
                       }
             }
 
-    f = pyedflib.EdfReader(input_filename)
+    with EdfMemmapReader(input_filename) as f:
+
+        # Get general informations
+        start_datetime = f.getStartdatetime()
+        exam_duration = f.getFileDuration()
+        ref_file = os.path.basename(input_filename)
+
+        # get ECG channel
+        signal_labels = f.getSignalLabels()
+        ecg_labels = get_ecg_labels(signal_labels)
+        n_ecg_channels = len(ecg_labels)
+        if n_ecg_channels != 1:
+            raise ValueError("Invalid ECG channels - " + str(n_ecg_channels))
 
-    # Get general informations
-    start_datetime = f.getStartdatetime()
-    exam_duration = f.getFileDuration()
-    ref_file = os.path.basename(input_filename)
+        ecg_label = ecg_labels[0]
+        ecg_channel_index = signal_labels.index(ecg_label)
 
-    # get ECG channel
-    signal_labels = f.getSignalLabels()
-    ecg_labels = get_ecg_labels(signal_labels)
-    n_ecg_channels = len(ecg_labels)
-    if n_ecg_channels != 1:
-        raise ValueError("Invalid ECG channels - " + str(n_ecg_channels))
+        # get ECG data and attributes - decoded on demand by detectors
+        ecg_data = f.getSignalView(ecg_channel_index)
+        fs = f.getSampleFrequency(ecg_channel_index)
 
-    ecg_label = ecg_labels[0]
-    ecg_channel_index = signal_labels.index(ecg_label)
+        beginning_frame = 0
 
-    # get ECG data and attributes
-    ecg_data = f.readSignal(ecg_channel_index)
-    fs = f.getSampleFrequency(ecg_channel_index)
+        # Skip flat, disconnected or saturated parts of the recording
+        usable_mask = get_signal_quality_mask(ecg_data, fs)
+        usable_segments = get_usable_segments(usable_mask, fs, len(ecg_data))
 
-    beginning_frame = 0
+        cardiac_infos = get_cardiac_infos(ecg_data,
+                                          fs,
+                                          {"gqrs": fs*2,  # Explain
+                                           "xqrs": fs,
+                                           "swt": fs*2,  # Explain
+                                           "hamilton": fs},
+                                          usable_segments)
 
-    qrs_frames_gqrs, rr_intervals_gqrs, hr_gqrs = \
-        get_cardiac_infos(ecg_data, fs*2, "gqrs")  # Explain
-    qrs_frames_xqrs, rr_intervals_xqrs, hr_xqrs = \
-        get_cardiac_infos(ecg_data, fs, "xqrs")
-    qrs_frames_swt, rr_intervals_swt, hr_swt = \
-        get_cardiac_infos(ecg_data, fs*2, "swt")  # Explain
+        # Release the ECG view before unmapping the EDF file
+        del ecg_data
+
+    qrs_frames_gqrs, rr_intervals_gqrs, hr_gqrs = cardiac_infos["gqrs"]
+    qrs_frames_xqrs, rr_intervals_xqrs, hr_xqrs = cardiac_infos["xqrs"]
+    qrs_frames_swt, rr_intervals_swt, hr_swt = cardiac_infos["swt"]
     qrs_frames_hamilton, rr_intervals_hamilton, hr_hamilton = \
-        get_cardiac_infos(ecg_data, fs, "hamilton")
+        cardiac_infos["hamilton"]
 
     hr_gqrs = hr_gqrs/2  # Explain
     hr_swt = hr_swt/2  # Explain
@@ -237,30 +628,76 @@ def detect_ecg(input_filename: str,
     qrs_frames_hamilton = beginning_frame + np.array(
         qrs_frames_hamilton)/fs
 
+    # RR intervals spanning a dead segment are flagged, in seconds
+    usable_segments_seconds = [[start / fs, end / fs]
+                               for start, end in usable_segments]
+    quality_gqrs = get_same_segment_mask(qrs_frames_gqrs,
+                                         usable_segments_seconds)
+    quality_xqrs = get_same_segment_mask(qrs_frames_xqrs,
+                                         usable_segments_seconds)
+    quality_swt = get_same_segment_mask(qrs_frames_swt,
+                                        usable_segments_seconds)
+    quality_hamilton = get_same_segment_mask(qrs_frames_hamilton,
+                                             usable_segments_seconds)
+
+    # Detectors are matched once their lag to the reference one is removed
+    lags = get_qrs_frames_lags({"gqrs": qrs_frames_gqrs,
+                                "xqrs": qrs_frames_xqrs,
+                                "swt": qrs_frames_swt,
+                                "hamilton": qrs_frames_hamilton})
+    aligned_qrs_frames_gqrs = qrs_frames_gqrs - lags["gqrs"]
+    aligned_qrs_frames_xqrs = qrs_frames_xqrs - lags["xqrs"]
+    aligned_qrs_frames_swt = qrs_frames_swt - lags["swt"]
+    aligned_qrs_frames_hamilton = qrs_frames_hamilton - lags["hamilton"]
+
+    # QRS frames are now expressed in seconds, hence a unit sampling frequency
     frame_correl_1, matching_frames_1, missing_beats_duration_1 = \
-        compute_qrs_frames_correlation(fs,
-                                       qrs_frames_gqrs,
-                                       qrs_frames_xqrs)
+        compute_qrs_frames_correlation(1,
+                                       aligned_qrs_frames_gqrs,
+                                       aligned_qrs_frames_xqrs)
     frame_correl_2, matching_frames_2, missing_beats_duration_2 = \
-        compute_qrs_frames_correlation(fs,
-                                       qrs_frames_gqrs,
-                                       qrs_frames_swt)
+        compute_qrs_frames_correlation(1,
+                                       aligned_qrs_frames_gqrs,
+                                       aligned_qrs_frames_swt)
     frame_correl_3, matching_frames_3, missing_beats_duration_3 = \
-        compute_qrs_frames_correlation(fs,
-                                       qrs_frames_xqrs,
-                                       qrs_frames_swt)
+        compute_qrs_frames_correlation(1,
+                                       aligned_qrs_frames_xqrs,
+                                       aligned_qrs_frames_swt)
     frame_correl_4, matching_frames_4, missing_beats_duration_4 = \
-        compute_qrs_frames_correlation(fs,
-                                       qrs_frames_gqrs,
-                                       qrs_frames_hamilton)
+        compute_qrs_frames_correlation(1,
+                                       aligned_qrs_frames_gqrs,
+                                       aligned_qrs_frames_hamilton)
     frame_correl_5, matching_frames_5, missing_beats_duration_5 = \
-        compute_qrs_frames_correlation(fs,
-                                       qrs_frames_xqrs,
-                                       qrs_frames_hamilton)
+        compute_qrs_frames_correlation(1,
+                                       aligned_qrs_frames_xqrs,
+                                       aligned_qrs_frames_hamilton)
     frame_correl_6, matching_frames_6, missing_beats_duration_6 = \
-        compute_qrs_frames_correlation(fs,
-                                       qrs_frames_swt,
-                                       qrs_frames_hamilton)
+        compute_qrs_frames_correlation(1,
+                                       aligned_qrs_frames_swt,
+                                       aligned_qrs_frames_hamilton)
+
+    # Score matrix shared by the output and the consensus detectors selection
+    corrcoefs = {"gqrs": [1, frame_correl_1, frame_correl_2, frame_correl_4],
+                 "xqrs": [frame_correl_1, 1, frame_correl_3, frame_correl_5],
+                 "swt": [frame_correl_2, frame_correl_3, 1, frame_correl_6],
+                 "hamilton": [frame_correl_4, frame_correl_5, frame_correl_6,
+                              1]
+                 }
+
+    qrs_frames_consensus, agreement_consensus, quality_consensus = \
+        compute_consensus_qrs_frames({"gqrs": aligned_qrs_frames_gqrs,
+                                      "xqrs": aligned_qrs_frames_xqrs,
+                                      "swt": aligned_qrs_frames_swt,
+                                      "hamilton": aligned_qrs_frames_hamilton},
+                                     corrcoefs)
+    quality_consensus = quality_consensus & get_same_segment_mask(
+        qrs_frames_consensus, usable_segments_seconds)
+    rr_intervals_consensus = np.zeros(0)
+    hr_consensus = np.zeros(0)
+    if len(qrs_frames_consensus):
+        # Consensus QRS are already expressed in seconds
+        rr_intervals_consensus = to_rr_intervals(qrs_frames_consensus, 1)
+        hr_consensus = to_hr(rr_intervals_consensus)
 
     data = {"infos": {"sampling_freq": fs,
                       "start_datetime": start_datetime.strftime(
@@ -270,31 +707,37 @@ def detect_ecg(input_filename: str,
                       },
             "gqrs": {"qrs": qrs_frames_gqrs.tolist(),
                      "rr_intervals": rr_intervals_gqrs.tolist(),
-                     "hr": hr_gqrs.tolist()
+                     "hr": hr_gqrs.tolist(),
+                     "quality": quality_gqrs.tolist()
                      },
             "xqrs": {"qrs": qrs_frames_xqrs.tolist(),
                      "rr_intervals": rr_intervals_xqrs.tolist(),
-                     "hr": hr_xqrs.tolist()
+                     "hr": hr_xqrs.tolist(),
+                     "quality": quality_xqrs.tolist()
                      },
             "swt": {"qrs": qrs_frames_swt.tolist(),
                     "rr_intervals": rr_intervals_swt.tolist(),
-                    "hr": hr_swt.tolist()
+                    "hr": hr_swt.tolist(),
+                    "quality": quality_swt.tolist()
                     },
             "hamilton": {"qrs": qrs_frames_hamilton.tolist(),
                          "rr_intervals": rr_intervals_hamilton.
                          tolist(),
-                         "hr": hr_hamilton.tolist()
+                         "hr": hr_hamilton.tolist(),
+                         "quality": quality_hamilton.tolist()
                          },
-            "score": {"corrcoefs":
-                      {"gqrs": [1, frame_correl_1, frame_correl_2,
-                                frame_correl_4],
-                       "xqrs": [frame_correl_1, 1, frame_correl_3,
-                                frame_correl_5],
-                       "swt": [frame_correl_2, frame_correl_3, 1,
-                               frame_correl_6],
-                       "hamilton": [frame_correl_4, frame_correl_5,
-                                    frame_correl_6, 1]
-                       },
+            "consensus": {"qrs": qrs_frames_consensus.tolist(),
+                          "rr_intervals": rr_intervals_consensus.tolist(),
+                          "hr": hr_consensus.tolist(),
+                          "agreement": agreement_consensus.tolist(),
+                          "quality": quality_consensus.tolist(),
+                          "lags": lags
+                          },
+            "signal_quality": {"window": SIGNAL_QUALITY_WINDOW,
+                               "usable": usable_mask.tolist(),
+                               "usable_segments": usable_segments_seconds
+                               },
+            "score": {"corrcoefs": corrcoefs,
                       "matching_frames":
                       {"gqrs": [1,
                                 matching_frames_1,
@@ -348,7 +791,16 @@ if __name__ == '__main__':
                         '--output_file',
                         dest='output_filename',
                         help='output file path')
+    parser.add_argument('--serve',
+                        dest='serve',
+                        action='store_true',
+                        help=('warm worker mode - read one JSON job per ' +
+                              'stdin line, with input_filename and ' +
+                              'output_filename keys'))
     args = parser.parse_args()
 
-    detect_ecg(input_filename=args.input_filename,
-               output_filename=args.output_filename)
+    if args.serve:
+        serve(detect_ecg)
+    else:
+        detect_ecg(input_filename=args.input_filename,
+                   output_filename=args.output_filename)
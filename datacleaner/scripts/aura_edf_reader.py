@@ -0,0 +1,195 @@
+# Copyright (C) 2021  The AURA developers
+# See the AUTHORS file at the top-level directory of this distribution
+# SPDX-License-Identifier: GPL-3.0
+
+import datetime
+import mmap
+import os
+import numpy as np
+
+
+# Fixed part of the EDF header, in bytes
+EDF_HEADER_BYTES = 256
+# Per signal header fields, in file order, with their width in bytes
+EDF_SIGNAL_HEADER_FIELDS = [("label", 16),
+                            ("transducer", 80),
+                            ("dimension", 8),
+                            ("physical_min", 8),
+                            ("physical_max", 8),
+                            ("digital_min", 8),
+                            ("digital_max", 8),
+                            ("prefilter", 80),
+                            ("samples_per_record", 8),
+                            ("reserved", 32)]
+# EDF+ annotations signal, hidden from signals as pyedflib does
+EDF_ANNOTATIONS_LABEL = "EDF Annotations"
+
+
+class EdfSignalView:
+    """Lazily scaled view on a single EDF signal.
+
+    Samples stay int16 in the memory-mapped data records and are converted
+    to physical units only for the requested slice, as pyedflib's
+    readSignal does for the whole signal. Mapped records are released once
+    decoded, so that reading the whole signal slice by slice does not keep
+    the whole file resident.
+    """
+
+    def __init__(self, records, samples_per_record, gain, offset,
+                 release_records):
+        self._records = records
+        self._samples_per_record = samples_per_record
+        self._gain = gain
+        self._offset = offset
+        self._release_records = release_records
+
+    def __len__(self):
+        return len(self._records) * self._samples_per_record
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, np.integer)):
+            if key < 0:
+                key += len(self)
+            return self[key:key + 1][0]
+
+        start, stop, step = key.indices(len(self))
+        if step != 1:
+            raise ValueError("Invalid slice step - " + str(step))
+        if stop <= start:
+            return np.zeros(0)
+
+        # Only decode the data records covering the slice
+        first_record = start // self._samples_per_record
+        last_record = (stop - 1) // self._samples_per_record + 1
+        digital = self._records[first_record:last_record].reshape(-1)
+        first_frame = first_record * self._samples_per_record
+        digital = digital[(start - first_frame):(stop - first_frame)]
+
+        physical = digital * self._gain + self._offset
+        self._release_records(first_record, last_record)
+        return physical
+
+    def __array__(self, dtype=None, copy=None):
+        physical = self[:]
+        if dtype is not None:
+            physical = physical.astype(dtype)
+        return physical
+
+
+class EdfMemmapReader:
+    """Memory-mapped EDF reader.
+
+    Exposes the subset of pyedflib.EdfReader used by the AURA scripts
+    without decoding any data record at opening time. As with pyedflib,
+    channel indices skip the EDF+ annotations signal. The reader can be
+    used as a context manager, signal views still alive when closing it
+    keeping the file mapped until they are released.
+    """
+
+    def __init__(self, filename):
+        # Header fields may hold non ASCII characters, e.g. patient names
+        with open(filename, "rb") as f:
+            header = f.read(EDF_HEADER_BYTES).decode("latin-1")
+            n_signals = int(header[252:256])
+            signal_header = f.read(n_signals * EDF_HEADER_BYTES).decode(
+                "latin-1")
+
+        self._start_date = header[168:176]
+        self._start_time = header[176:184]
+        header_bytes = int(header[184:192])
+        n_records = int(header[236:244])
+        self._record_duration = float(header[244:252])
+
+        self._signal_headers = [{} for _ in range(n_signals)]
+        position = 0
+        for field, width in EDF_SIGNAL_HEADER_FIELDS:
+            for k in range(n_signals):
+                self._signal_headers[k][field] = signal_header[
+                    position:position + width].strip()
+                position += width
+
+        # Channel index to signal index in data records
+        self._channels = [k for k, signal_header in enumerate(
+            self._signal_headers)
+            if signal_header["label"] != EDF_ANNOTATIONS_LABEL]
+
+        record_dtype = np.dtype(
+            [("signal_" + str(k), "<i2",
+              (int(signal_header["samples_per_record"]),))
+             for k, signal_header in enumerate(self._signal_headers)])
+
+        # Number of data records may be unknown (-1) in the header
+        if n_records < 0:
+            n_records = (os.path.getsize(filename) - header_bytes) // \
+                record_dtype.itemsize
+
+        with open(filename, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._header_bytes = header_bytes
+        self._records = np.frombuffer(self._mmap,
+                                      dtype=record_dtype,
+                                      count=n_records,
+                                      offset=header_bytes)
+
+    def _release_records(self, first_record, last_record):
+        # Drop the mapped pages from the process, they stay in page cache
+        if not hasattr(mmap, "MADV_DONTNEED"):
+            return
+        start = self._header_bytes + first_record * self._records.itemsize
+        start -= start % mmap.PAGESIZE
+        stop = self._header_bytes + last_record * self._records.itemsize
+        self._mmap.madvise(mmap.MADV_DONTNEED, start, stop - start)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self._records = None
+        try:
+            self._mmap.close()
+        except BufferError:
+            # Unmapped once the signal views are garbage collected
+            pass
+
+    def getSignalLabels(self):
+        return [self._signal_headers[k]["label"] for k in self._channels]
+
+    def getSampleFrequency(self, chn):
+        signal_header = self._signal_headers[self._channels[chn]]
+        return int(signal_header["samples_per_record"]) / \
+            self._record_duration
+
+    def getFileDuration(self):
+        return len(self._records) * self._record_duration
+
+    def getStartdatetime(self):
+        day, month, year = [int(token)
+                            for token in self._start_date.split(".")]
+        hour, minute, second = [int(token)
+                                for token in self._start_time.split(".")]
+        # EDF years are stored on two digits, 1985 being the clipping date
+        year += 1900 if year >= 85 else 2000
+        return datetime.datetime(year, month, day, hour, minute, second)
+
+    def getSignalView(self, chn):
+        signal_header = self._signal_headers[self._channels[chn]]
+        physical_min = float(signal_header["physical_min"])
+        physical_max = float(signal_header["physical_max"])
+        digital_min = float(signal_header["digital_min"])
+        digital_max = float(signal_header["digital_max"])
+
+        gain = (physical_max - physical_min) / (digital_max - digital_min)
+        offset = physical_min - gain * digital_min
+
+        return EdfSignalView(self._records["signal_" + str(
+                                 self._channels[chn])],
+                             int(signal_header["samples_per_record"]),
+                             gain,
+                             offset,
+                             self._release_records)
+
+    def readSignal(self, chn):
+        return self.getSignalView(chn)[:]
@@ -1,29 +1,51 @@
 import argparse
 import json
 import numpy as np
-from hrvanalysis import remove_outliers, remove_ectopic_beats, \
-                        interpolate_nan_values
-from hrvanalysis import get_time_domain_features, get_csi_cvi_features, \
-                        get_sampen, get_poincare_plot_features, \
-                        get_frequency_domain_features
-import scipy.signal as signal
+from aura_worker import serve
+
+# hrvanalysis and scipy are heavy to import, they are only loaded when
+# features are computed
 
 SHORT_WINDOW = 10000  # hort window lasts 10 seconds - 10 000 milliseconds
 MEDIUM_WINDOW = 60000  # medium window lasts 60 secondes
 LARGE_WINDOW = 150000  # large window lasts 2 minutes 30 seconds
+# Intervals less than half covered by usable ECG signal are skipped
+MIN_USABLE_RATIO = 0.5
+
+# A window scheme sets the output intervals spacing ("stride", in
+# milliseconds) and the windows feature families are computed on. Each
+# window ends with its output interval and lasts "length" milliseconds.
+DEFAULT_WINDOW_SCHEME = {
+    'name': 'default',
+    'stride': SHORT_WINDOW,
+    'windows': [{'name': 'short',
+                 'length': SHORT_WINDOW,
+                 'families': ['time_domain']},
+                {'name': 'medium',
+                 'length': MEDIUM_WINDOW,
+                 'families': ['csi_cvi', 'sampen', 'poincare']},
+                {'name': 'large',
+                 'length': LARGE_WINDOW,
+                 'families': ['frequency_domain']}]
+}
 
 
-def get_rr_intervals_on_window(rr_timestamps,
-                               rrs,
-                               offset, window):
-
-    rr_indices = np.logical_and(
-        rr_timestamps >= offset, rr_timestamps < (offset + window))
+def get_window_index(rr_timestamps, interval_ends, window):
+    """Index range [start, end[ of the RR intervals timestamped within the
+    window ending at each interval end.
+    """
+    window_index = np.empty([len(interval_ends), 2], dtype=int)
+    window_index[:, 0] = np.searchsorted(rr_timestamps,
+                                         interval_ends - window)
+    window_index[:, 1] = np.searchsorted(rr_timestamps, interval_ends)
 
-    return rrs[rr_indices]
+    return window_index
 
 
 def get_clean_intervals(rrs):
+    from hrvanalysis import remove_outliers, remove_ectopic_beats, \
+        interpolate_nan_values
+    import scipy.signal as signal
 
     # This remove outliers from signal
     rr_intervals_without_outliers = remove_outliers(rr_intervals=rrs,
@@ -49,91 +71,118 @@ def get_clean_intervals(rrs):
     return median_interpolated_nn_intervals
 
 
-def compute_short_term_features_on_interval(features, i, rr_timestamps, rrs):
-    # Adding indexes
-    features[i][
-        FEATURES_KEY_TO_INDEX["interval_index"]] = i
-    features[i][
-        FEATURES_KEY_TO_INDEX["interval_start_time"]] = i * SHORT_WINDOW
+def compute_time_domain_features(clean_rrs):
+    from hrvanalysis import get_time_domain_features
+    return get_time_domain_features(clean_rrs)
 
-    rrs_on_interval = get_rr_intervals_on_window(
-        rr_timestamps,
-        rrs,
-        i * SHORT_WINDOW, SHORT_WINDOW)
 
-    if(len(rrs_on_interval) == 0):
-        raise ValueError("No RR intervals")
+def compute_frequency_domain_features(clean_rrs):
+    from hrvanalysis import get_frequency_domain_features
+    return get_frequency_domain_features(clean_rrs)
 
-    clean_rrs = get_clean_intervals(rrs_on_interval)
-    time_domain_features = get_time_domain_features(clean_rrs)
-    for key in time_domain_features.keys():
-        features[i][FEATURES_KEY_TO_INDEX[key]] = time_domain_features[key]
 
+def compute_csi_cvi_features(clean_rrs):
+    from hrvanalysis import get_csi_cvi_features
+    return get_csi_cvi_features(clean_rrs)
 
-def compute_medium_term_features_on_interval(features,
-                                             i,
-                                             rr_timestamps,
-                                             rrs,
-                                             medium_window_offset):
 
-    if (i * SHORT_WINDOW) > MEDIUM_WINDOW:
-        rr_on_medium_intervals = get_rr_intervals_on_window(
-            rr_timestamps,
-            rrs,
-            (i - medium_window_offset) * SHORT_WINDOW,
-            MEDIUM_WINDOW)
+def compute_sampen_features(clean_rrs):
+    from hrvanalysis import get_sampen
+    return get_sampen(clean_rrs)
 
-        clean_rrs = get_clean_intervals(rr_on_medium_intervals)
 
-        if len(rr_on_medium_intervals) == 0:
-            raise ValueError("No RR intervals")
+def compute_poincare_features(clean_rrs):
+    from hrvanalysis import get_poincare_plot_features
+    return get_poincare_plot_features(clean_rrs)
 
-        # Compute non linear features
-        cvi_csi_features = get_csi_cvi_features(clean_rrs)
-        for key in cvi_csi_features.keys():
-            features[i][FEATURES_KEY_TO_INDEX[key]] = cvi_csi_features[key]
 
-        sampen = get_sampen(clean_rrs)
-        features[i][FEATURES_KEY_TO_INDEX["sampen"]] = sampen["sampen"]
+# Registry of feature families, in output order, with the features they
+# output and the function computing them on clean RR intervals
+FEATURE_FAMILIES = {
+    'time_domain': {'keys': ['mean_nni', 'sdnn', 'sdsd', 'nni_50',
+                             'pnni_50', 'nni_20', 'pnni_20', 'rmssd',
+                             'median_nni', 'range_nni', 'cvsd', 'cvnni',
+                             'mean_hr', 'max_hr', 'min_hr', 'std_hr'],
+                    'compute': compute_time_domain_features},
+    'frequency_domain': {'keys': ['lf', 'hf', 'vlf', 'lf_hf_ratio'],
+                         'compute': compute_frequency_domain_features},
+    'csi_cvi': {'keys': ['csi', 'cvi', 'Modified_csi'],
+                'compute': compute_csi_cvi_features},
+    'sampen': {'keys': ['sampen'],
+               'compute': compute_sampen_features},
+    'poincare': {'keys': ['sd1', 'sd2', 'ratio_sd2_sd1'],
+                 'compute': compute_poincare_features}
+}
 
-        poincare_features = get_poincare_plot_features(clean_rrs)
-        for key in poincare_features.keys():
-            features[i][FEATURES_KEY_TO_INDEX[key]] = poincare_features[key]
 
+def compute_family_features(family, clean_rrs):
 
-def compute_long_term_features_on_interval(features,
-                                           i,
-                                           rr_timestamps,
-                                           rrs,
-                                           large_window_offset):
+    family_features = FEATURE_FAMILIES[family]["compute"](clean_rrs)
 
-    if (i * SHORT_WINDOW) > LARGE_WINDOW:
-        rr_on_large_intervals = get_rr_intervals_on_window(
-            rr_timestamps,
-            rrs,
-            (i - large_window_offset) * SHORT_WINDOW,
-            LARGE_WINDOW)
+    return [family_features[key] for key in FEATURE_FAMILIES[family]["keys"]]
 
-        if len(rr_on_large_intervals) == 0:
-            raise ValueError("No RR intervals")
 
-        clean_rrs = get_clean_intervals(rr_on_large_intervals)
+def get_window_range_on_interval(i,
+                                 window,
+                                 window_index,
+                                 interval_end,
+                                 usable_segments):
+    """RR index range [start, end[ of the window ending at interval_end,
+    None when the window is not usable.
+    """
+    offset = interval_end - window["length"]
+    if offset < 0 or not is_usable_window(usable_segments,
+                                          offset,
+                                          window["length"]):
+        return None
 
-        # Compute frequency domain features
-        frequency_domain_features = get_frequency_domain_features(clean_rrs)
-        for key in frequency_domain_features.keys():
-            if key in FEATURES_KEY_TO_INDEX:
-                features[i][
-                    FEATURES_KEY_TO_INDEX[
-                        key]] = frequency_domain_features[key]
+    start, end = window_index[i]
+    if start == end:
+        raise ValueError("No RR intervals")
+
+    return start, end
+
+
+def compute_windows_features(windows_targets, rrs):
+    """Compute the features of the windows ending together.
+
+    windows_targets maps each RR index range to the (features, i, window,
+    window_columns) requesting it, from any window scheme. Each range is
+    cleaned once and each of its feature families computed once, clean RR
+    intervals being dropped right after.
+    """
+    for (start, end), targets in windows_targets.items():
+        try:
+            clean_rrs = get_clean_intervals(rrs[start:end])
+            for family in FEATURE_FAMILIES.keys():
+                family_targets = [target for target in targets
+                                  if family in target[2]["families"]]
+                if len(family_targets) == 0:
+                    continue
+
+                family_features = compute_family_features(family,
+                                                          clean_rrs)
+                for features, i, window, window_columns in family_targets:
+                    features[i, window_columns[family]] = family_features
+
+        except Exception as e:
+            for features, i, window, window_columns in targets:
+                print("Interval " +
+                      str(i) +
+                      " - computation issue on " +
+                      window["name"] +
+                      " window features - " +
+                      str(e))
 
 
 def compute_labels_on_interval(features,
                                i,
                                background_intervals,
-                               seizure_intervals):
+                               seizure_intervals,
+                               features_key_to_index,
+                               stride=SHORT_WINDOW):
 
-    short_interval_s = SHORT_WINDOW * 0.001
+    short_interval_s = stride * 0.001
     interval_range = [[i * short_interval_s, (i+1) * short_interval_s]]
     intersec_interval_background = intersections(interval_range,
                                                  background_intervals)
@@ -152,10 +201,26 @@ def compute_labels_on_interval(features,
     ratio_seizure = sum_seizure / short_interval_s
 
     if (ratio_background + ratio_seizure) < 0.9:
-        features[i][FEATURES_KEY_TO_INDEX["label"]] = np.NaN
+        features[i][features_key_to_index["label"]] = np.NaN
 
     else:
-        features[i][FEATURES_KEY_TO_INDEX["label"]] = ratio_seizure
+        features[i][features_key_to_index["label"]] = ratio_seizure
+
+
+def is_usable_window(usable_segments, offset, window):
+
+    # No signal quality assessment available
+    if usable_segments is None:
+        return True
+
+    window_range = [[offset * 0.001, (offset + window) * 0.001]]
+    intersec_window_usable = intersections(window_range, usable_segments)
+
+    sum_usable = 0
+    for interval in intersec_window_usable:
+        sum_usable += (interval[1] - interval[0])
+
+    return (sum_usable / (window * 0.001)) >= MIN_USABLE_RATIO
 
 
 def get_annotations_data(annotations_filename):
@@ -197,44 +262,219 @@ def intersections(a, b):
     return ranges
 
 
-FEATURES_KEY_TO_INDEX = {
-    'interval_index': 0,
-    'interval_start_time': 1,  # inmilliseconds
-    'mean_nni': 2,
-    'sdnn': 3,
-    'sdsd': 4,
-    'nni_50': 5,
-    'pnni_50': 6,
-    'nni_20': 7,
-    'pnni_20': 8,
-    'rmssd': 9,
-    'median_nni': 10,
-    'range_nni': 11,
-    'cvsd': 12,
-    'cvnni': 13,
-    'mean_hr': 14,
-    'max_hr': 15,
-    'min_hr': 16,
-    'std_hr': 17,
-    'lf': 18,
-    'hf': 19,
-    'vlf': 20,
-    'lf_hf_ratio': 21,
-    'csi': 22,
-    'cvi': 23,
-    'Modified_csi': 24,
-    'sampen': 25,
-    'sd1': 26,
-    'sd2': 27,
-    'ratio_sd2_sd1': 28,
-    'label': 29
-}
+def get_families_suffix(window_scheme, window):
+    """Suffix of the feature keys of each family computed on window, the
+    window name when the family runs on several windows of the scheme.
+    """
+    families_suffix = {}
+    for family in window["families"]:
+        n_windows = len([other_window
+                         for other_window in window_scheme["windows"]
+                         if family in other_window["families"]])
+        families_suffix[family] = "_" + window["name"] if n_windows > 1 \
+            else ""
+
+    return families_suffix
+
+
+def get_features_columns(window_scheme):
+    """Output keys of a window scheme, and the column slice of each family
+    for each window.
+    """
+    keys = ['interval_index',
+            'interval_start_time']  # inmilliseconds
+    windows_columns = [{} for _ in window_scheme["windows"]]
+    for family in FEATURE_FAMILIES.keys():
+        for window, window_columns in zip(window_scheme["windows"],
+                                          windows_columns):
+            if family in window["families"]:
+                families_suffix = get_families_suffix(window_scheme, window)
+                window_columns[family] = slice(
+                    len(keys), len(keys) + len(FEATURE_FAMILIES[family][
+                        "keys"]))
+                keys += [key + families_suffix[family]
+                         for key in FEATURE_FAMILIES[family]["keys"]]
+    keys += ['label']
+
+    return keys, windows_columns
+
+
+def check_window_scheme(window_scheme):
+
+    if window_scheme["stride"] <= 0:
+        raise ValueError("Invalid window scheme stride - " +
+                         str(window_scheme["stride"]))
+
+    for window in window_scheme["windows"]:
+        if window["length"] <= 0:
+            raise ValueError("Invalid window length - " +
+                             str(window["length"]))
+        for family in window["families"]:
+            if family not in FEATURE_FAMILIES:
+                raise ValueError("Invalid feature family - " + family)
+
+
+def get_enabled_window_scheme(window_scheme, enabled_families):
+    """Restrict a window scheme to the enabled feature families, dropping
+    windows left without any.
+    """
+    windows = []
+    for window in window_scheme["windows"]:
+        families = [family for family in window["families"]
+                    if family in enabled_families]
+        if len(families):
+            windows.append(dict(window, families=families))
+
+    return dict(window_scheme, windows=windows)
+
+
+def get_window_scheme_output_filename(output_filename,
+                                      window_scheme,
+                                      n_window_schemes):
+
+    # Several window schemes are written next to each other
+    if n_window_schemes == 1:
+        return output_filename
+    return output_filename[:-len(".json")] + "_" + window_scheme["name"] + \
+        ".json"
+
+
+def init_window_scheme_features(window_scheme,
+                                rr_timestamps,
+                                duration,
+                                dtype=np.float64):
+    """Features matrix of a window scheme, holding interval indexes only,
+    with the window scheme state needed to fill it.
+    """
+    stride = window_scheme["stride"]
+    n_intervals = (int)(duration / stride) + 1
+    keys, windows_columns = get_features_columns(window_scheme)
+    features_key_to_index = {key: index for index, key in enumerate(keys)}
+
+    features = np.empty([n_intervals,
+                        len(features_key_to_index.keys())], dtype=dtype)
+    features[:] = np.NaN
+
+    # Adding indexes
+    features[:, features_key_to_index["interval_index"]] = np.arange(
+        n_intervals)
+    features[:, features_key_to_index["interval_start_time"]] = np.arange(
+        n_intervals) * stride
+
+    # Beat index table of every window, shared by its feature families
+    interval_ends = (np.arange(n_intervals) + 1) * stride
+    windows_index = [get_window_index(rr_timestamps,
+                                      interval_ends,
+                                      window["length"])
+                     for window in window_scheme["windows"]]
+
+    return {"window_scheme": window_scheme,
+            "keys": keys,
+            "features_key_to_index": features_key_to_index,
+            "windows_columns": windows_columns,
+            "features": features,
+            "interval_ends": interval_ends,
+            "windows_index": windows_index}
+
+
+def compute_window_schemes_features(window_schemes,
+                                    rr_timestamps,
+                                    rrs,
+                                    duration,
+                                    usable_segments,
+                                    background_intervals,
+                                    seizure_intervals,
+                                    dtype=np.float64):
+    """Compute the features of all window schemes in a single pass on RR
+    data, returning the keys and features of each scheme.
+
+    Intervals of all schemes are walked in time order, so that the windows
+    ending together are shared between schemes and feature families, and
+    nothing is kept once their interval end is passed.
+    """
+    schemes_features = [init_window_scheme_features(window_scheme,
+                                                    rr_timestamps,
+                                                    duration,
+                                                    dtype)
+                        for window_scheme in window_schemes]
+
+    all_interval_ends = np.unique(np.concatenate(
+        [scheme_features["interval_ends"]
+         for scheme_features in schemes_features]))
+    # Next interval of each window scheme
+    next_intervals = [0 for _ in schemes_features]
+
+    for interval_end in all_interval_ends:
+        windows_targets = {}
+        for k, scheme_features in enumerate(schemes_features):
+            i = next_intervals[k]
+            if i >= len(scheme_features["interval_ends"]) or \
+                    scheme_features["interval_ends"][i] != interval_end:
+                continue
+            next_intervals[k] += 1
+
+            window_scheme = scheme_features["window_scheme"]
+            features = scheme_features["features"]
+            try:
+                compute_labels_on_interval(
+                    features,
+                    i,
+                    background_intervals,
+                    seizure_intervals,
+                    scheme_features["features_key_to_index"],
+                    window_scheme["stride"])
+            except Exception as e:
+                print("Interval " +
+                      str(i) +
+                      " - label computation issue - " +
+                      str(e))
+
+            for window, window_index, window_columns in zip(
+                    window_scheme["windows"],
+                    scheme_features["windows_index"],
+                    scheme_features["windows_columns"]):
+                try:
+                    window_range = get_window_range_on_interval(
+                        i,
+                        window,
+                        window_index,
+                        interval_end,
+                        usable_segments)
+                except Exception as e:
+                    print("Interval " +
+                          str(i) +
+                          " - computation issue on " +
+                          window["name"] +
+                          " window features - " +
+                          str(e))
+                    continue
+
+                if window_range is not None:
+                    windows_targets.setdefault(window_range, []).append(
+                        (features, i, window, window_columns))
+
+        compute_windows_features(windows_targets, rrs)
+
+    return [(scheme_features["keys"], scheme_features["features"])
+            for scheme_features in schemes_features]
 
 
 def compute_features(input_filename: str,
                      output_filename: str,
                      annotations_filename: str,
-                     qrs_detector: str):
+                     qrs_detector: str,
+                     window_schemes: list = None,
+                     enabled_families: list = None,
+                     dtype=np.float64):
+
+    if window_schemes is None:
+        window_schemes = [DEFAULT_WINDOW_SCHEME]
+
+    # Only enabled feature families are computed and output
+    if enabled_families is not None:
+        window_schemes = [get_enabled_window_scheme(window_scheme,
+                                                    enabled_families)
+                          for window_scheme in window_schemes]
 
     try:
         # Get QRS frames / RR intervals data
@@ -243,75 +483,92 @@ def compute_features(input_filename: str,
             annotations_filename)
 
         rrs = np.asarray(raw_data[qrs_detector]["rr_intervals"])
-        rr_timestamps = np.cumsum(rrs)
+        # RR intervals are timestamped by their closing QRS, in milliseconds
+        # from the beginning of the recording
+        rr_timestamps = np.asarray(raw_data[qrs_detector]["qrs"][1:]) * 1000
+
+        # Usable ECG segments, in seconds, when signal quality was assessed
+        usable_segments = None
+        if "signal_quality" in raw_data:
+            usable_segments = raw_data["signal_quality"]["usable_segments"]
+
+        # Fused series flag the RR intervals detectors disagree on
+        if "quality" in raw_data[qrs_detector]:
+            quality = np.asarray(raw_data[qrs_detector]["quality"],
+                                 dtype=bool)
+            rr_timestamps = rr_timestamps[quality]
+            rrs = rrs[quality]
 
         duration = rr_timestamps[-1] + rrs[-1]
-        n_short_intervals = (int)(duration / SHORT_WINDOW) + 1
-        medium_window_offset = MEDIUM_WINDOW / SHORT_WINDOW
-        # large_window_offset = LARGE_WINDOW / SHORT_WINDOW
 
-        features = np.empty([n_short_intervals,
-                            len(FEATURES_KEY_TO_INDEX.keys())])
-        features[:] = np.NaN
-
-        # Sequence features computations in ten seconds intervals
-        for i in range(0, n_short_intervals):
-            try:
-                compute_labels_on_interval(features,
-                                           i,
-                                           background_intervals,
-                                           seizure_intervals)
-            except Exception as e:
-                print("Interval " +
-                      str(i) +
-                      " - label computation issue - " +
-                      str(e))
+        schemes_features = compute_window_schemes_features(
+            window_schemes,
+            rr_timestamps,
+            rrs,
+            duration,
+            usable_segments,
+            background_intervals,
+            seizure_intervals,
+            dtype)
+
+        for window_scheme, (keys, features) in zip(window_schemes,
+                                                   schemes_features):
+            data = {"keys": keys,
+                    "features": features.tolist()}
+            json.dump(data, open(get_window_scheme_output_filename(
+                output_filename, window_scheme, len(window_schemes)), "w"))
 
-            try:
-                compute_short_term_features_on_interval(features,
-                                                        i,
-                                                        rr_timestamps,
-                                                        rrs)
+    except Exception as e:
+        print(e)
+        raise
 
-            except Exception as e:
-                print("Interval " +
-                      str(i) +
-                      "- computation issue on short term features " +
-                      str(e))
 
-            try:
-                compute_medium_term_features_on_interval(features,
-                                                         i,
-                                                         rr_timestamps,
-                                                         rrs,
-                                                         medium_window_offset)
+def run_features_computation(input_filename: str,
+                             output_filename: str,
+                             annotations_filename: str,
+                             qrs_detector: str,
+                             window_schemes_filename: str = None,
+                             feature_families: str = None,
+                             float32: bool = False):
 
-            except Exception as e:
-                print("Interval " +
-                      str(i) +
-                      "- computation issue on medium term features" +
-                      str(e))
+    if not input_filename.endswith('.json'):
+        raise ValueError('Invalid input filepath')
 
-            try:
-                compute_long_term_features_on_interval(features,
-                                                       i,
-                                                       rr_timestamps,
-                                                       rrs,
-                                                       medium_window_offset)
+    if not output_filename.endswith('.json'):
+        raise ValueError('Invalid output filepath ')
 
-            except Exception as e:
-                print("Interval " +
-                      str(i) +
-                      "- computation issue on long term features"
-                      + str(e))
+    if qrs_detector.lower() not in ['gqrs',
+                                    'xqrs',
+                                    'hamilton',
+                                    'engelsee',
+                                    'swt',
+                                    'consensus']:
+        raise ValueError("Invalid QRS Detector ")
 
-        keys = [key for key in FEATURES_KEY_TO_INDEX.keys()]
-        data = {"keys": keys,
-                "features": features.tolist()}
-        json.dump(data, open(output_filename, "w"))
+    # A window schemes file holds a single scheme or a list of schemes
+    window_schemes = None
+    if window_schemes_filename is not None:
+        window_schemes = json.load(open(window_schemes_filename, 'r'))
+        if isinstance(window_schemes, dict):
+            window_schemes = [window_schemes]
+        for window_scheme in window_schemes:
+            check_window_scheme(window_scheme)
+
+    # Feature families are given as a comma separated list
+    enabled_families = None
+    if feature_families is not None:
+        enabled_families = feature_families.split(",")
+        for family in enabled_families:
+            if family not in FEATURE_FAMILIES:
+                raise ValueError("Invalid feature family - " + family)
 
-    except Exception as e:
-        print(e)
+    compute_features(input_filename=input_filename,
+                     output_filename=output_filename,
+                     annotations_filename=annotations_filename,
+                     qrs_detector=qrs_detector.lower(),
+                     window_schemes=window_schemes,
+                     enabled_families=enabled_families,
+                     dtype=np.float32 if float32 else np.float64)
 
 
 if __name__ == '__main__':
@@ -335,31 +592,44 @@ if __name__ == '__main__':
                         help=('QRS detector used - available:' +
                               '1/ pan-tompkins, ' +
                               '2/ swt - Stationnary Wavelets tramsform,' +
-                              '3/ XQRS'))
+                              '3/ XQRS, ' +
+                              '4/ consensus - fusion of all detectors'))
+    parser.add_argument('-w',
+                        '--window_schemes_file',
+                        dest='window_schemes_filename',
+                        help=('window schemes file path - JSON scheme or ' +
+                              'list of schemes, the default one being ' +
+                              '10 s stride with 10 s, 60 s and 150 s ' +
+                              'windows'))
+    parser.add_argument('-f',
+                        '--feature_families',
+                        dest='feature_families',
+                        help=('comma separated feature families to ' +
+                              'compute, all by default - available: ' +
+                              ', '.join(FEATURE_FAMILIES.keys())))
+    parser.add_argument('--float32',
+                        dest='float32',
+                        action='store_true',
+                        help='compute features in single precision')
+    parser.add_argument('--serve',
+                        dest='serve',
+                        action='store_true',
+                        help=('warm worker mode - read one JSON job per ' +
+                              'stdin line, with input_filename, ' +
+                              'output_filename, annotations_filename, ' +
+                              'qrs_detector and optional ' +
+                              'window_schemes_filename, feature_families ' +
+                              'and float32 keys'))
     args = parser.parse_args()
 
-    if not args.input_filename.endswith('.json'):
-        raise ValueError('Invalid input filepath')
-        exit()
-
-    if not args.output_filename.endswith('.json'):
-        raise ValueError('Invalid output filepath ')
-        exit()
-
-    if args.qrs_detector_used.lower() not in ['gqrs',
-                                              'xqrs',
-                                              'hamilton',
-                                              'engelsee',
-                                              'swt']:
-        raise ValueError("Invalid QRS Detector ")
-        exit()
-
-    output_filename = args.output_filename
-    input_filename = args.input_filename
-    qrs_detector = args.qrs_detector_used.lower()
-    annotations_filename = args.annotations_filename
-
-    compute_features(input_filename=input_filename,
-                     output_filename=output_filename,
-                     annotations_filename=annotations_filename,
-                     qrs_detector=qrs_detector)
+    if args.serve:
+        serve(run_features_computation)
+    else:
+        run_features_computation(
+            input_filename=args.input_filename,
+            output_filename=args.output_filename,
+            annotations_filename=args.annotations_filename,
+            qrs_detector=args.qrs_detector_used,
+            window_schemes_filename=args.window_schemes_filename,
+            feature_families=args.feature_families,
+            float32=args.float32)
@@ -0,0 +1,33 @@
+# Copyright (C) 2021  The AURA developers
+# See the AUTHORS file at the top-level directory of this distribution
+# SPDX-License-Identifier: GPL-3.0
+
+import contextlib
+import json
+import sys
+
+
+def serve(run_job):
+    """Run jobs read from stdin in a warm interpreter.
+
+    Each stdin line is a JSON job descriptor, passed as keyword arguments
+    to run_job. For each job, a single "<status>\\t<output_filename>" line
+    is written to stdout, status being OK or Fail. Anything printed by the
+    job itself goes to stderr.
+    """
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+
+        output_filename = None
+        try:
+            job = json.loads(line)
+            output_filename = job.get("output_filename")
+            with contextlib.redirect_stdout(sys.stderr):
+                run_job(**job)
+            status = "OK"
+        except Exception as e:
+            print("Job " + line.strip() + " - " + str(e), file=sys.stderr)
+            status = "Fail"
+
+        print(status + "\t" + str(output_filename), flush=True)